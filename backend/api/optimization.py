@@ -2,20 +2,82 @@
 Main optimization endpoint - Natural language payment optimization
 """
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import ORJSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, Dict, Any
+from cachetools import TTLCache
+import orjson
+import asyncio
+import hashlib
 import logging
+import re
 
 from database.database import get_db
 from services.claude_service import ClaudeService
 from services.brave_search_service import BraveSearchService
 from services.card_optimizer import CardOptimizer
-from services.fallback_responses import get_fallback_recommendation
+from services.fallback_responses import get_fallback_recommendation_bytes
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Hard caps on each provider step, a little above the services' own client timeouts,
+# so a hung connection can't hold the request open indefinitely
+CLAUDE_PARSE_TIMEOUT = 9.0
+CLAUDE_RECOMMEND_TIMEOUT = 13.0
+BRAVE_TIMEOUT = 10.0
+
+_EMPTY_MARKET_ANALYSIS = {"results": [], "queries_used": [], "total_sources": 0, "is_fallback": True}
+
+# Cheap keyword table used to guess the category before Claude has parsed the query
+CATEGORY_KEYWORDS = {
+    "dining": ['starbucks', 'coffee', 'cafe', 'restaurant', 'dining', 'lunch', 'dinner'],
+    "grocery": ['grocery', 'whole foods', 'walmart', 'target', 'kroger'],
+    "gas": ['gas', 'shell', 'exxon', 'chevron'],
+    "travel": ['flight', 'hotel', 'travel', 'trip', 'airline', 'vacation'],
+}
+
+def _keyword_pattern(keyword: str) -> str:
+    # "whole foods" also matches "wholefoods" / "whole  foods"
+    return r"\s*".join(re.escape(part) for part in keyword.split())
+
+# Compiled once: one named group per category, keywords anchored at a word start
+_CATEGORY_RE = re.compile(
+    "|".join(
+        rf"(?P<{category}>\b(?:" + "|".join(_keyword_pattern(k) for k in keywords) + "))"
+        for category, keywords in CATEGORY_KEYWORDS.items()
+    ),
+    re.IGNORECASE,
+)
+
+def guess_category(query: str) -> Optional[str]:
+    """Guess the spending category from keywords, or None if nothing matches"""
+    match = _CATEGORY_RE.search(query)
+    return match.lastgroup if match else None
+
+# Shared service instances so API clients and their connection pools are reused across requests
+_claude_service = ClaudeService()
+_brave_service = BraveSearchService()
+
+async def get_optimizer(db: AsyncSession = Depends(get_db)) -> CardOptimizer:
+    """Build a per-request optimizer around the shared services and a DB session"""
+    return CardOptimizer(_claude_service, _brave_service, db)
+
+async def warmup_services():
+    """Pre-open provider connections at startup; failures are logged, never fatal"""
+    await asyncio.gather(_claude_service.warmup(), _brave_service.warmup(), return_exceptions=True)
+
+async def close_services():
+    """Release the shared services' network resources on shutdown"""
+    await asyncio.gather(_claude_service.aclose(), _brave_service.aclose(), return_exceptions=True)
+
+# Full /optimize responses keyed by normalized query, plus the pipeline run in flight per key
+# so concurrent identical requests share one run (and its result, cacheable or not)
+_response_cache: TTLCache = TTLCache(maxsize=2048, ttl=600)
+_inflight: Dict[str, "asyncio.Task[Optional[Dict[str, Any]]]"] = {}
+
 class OptimizationRequest(BaseModel):
     query: str
     user_context: Optional[str] = None
@@ -26,23 +88,124 @@ class OptimizationResponse(BaseModel):
     recommendation: Dict[str, Any]
     financial_insight: Dict[str, Any]
 
-@router.post("/optimize")
-async def optimize_payment(request: OptimizationRequest, db: Session = Depends(get_db)):
-    """Main optimization endpoint with full market analysis"""
+def _is_degraded(result: Dict[str, Any]) -> bool:
+    """True if any stage fell back to canned data (API error, timeout, open breaker)"""
+    return any(
+        isinstance(result.get(stage), dict) and result[stage].get("is_fallback")
+        for stage in ("transaction", "market_analysis", "recommendation")
+    )
+
+def _cache_key(request: OptimizationRequest) -> str:
+    """Normalize query + user context into a stable cache key"""
+    normalized = re.sub(r"\s+", " ", request.query.lower().strip())
+    context = re.sub(r"\s+", " ", (request.user_context or "").lower().strip())
+    return hashlib.blake2b(f"{normalized}\x00{context}".encode(), digest_size=16).hexdigest()
+
+def _slim_response(response: Dict[str, Any], verbose: bool) -> Dict[str, Any]:
+    """Project market_analysis results to the fields the frontend uses"""
+    market_analysis = response.get("market_analysis")
+    if verbose or not isinstance(market_analysis, dict) or "results" not in market_analysis:
+        return response
+    slim_results = [
+        {
+            "title": r.get("title"),
+            "url": r.get("url"),
+            "credibility": r.get("credibility"),
+            "description": (r.get("description") or "")[:280],
+        }
+        for r in (market_analysis.get("results") or [])[:10]
+    ]
+    return {**response, "market_analysis": {**market_analysis, "results": slim_results}}
+
+# Responses estimated above this many bytes are encoded in a worker thread
+LARGE_PAYLOAD_BYTES = 32_000
+
+def _estimate_size(response: Dict[str, Any]) -> int:
+    """Rough byte estimate dominated by the search results' text fields"""
+    results = (response.get("market_analysis") or {}).get("results") or []
+    return 4_000 + sum(
+        len(r.get("title") or "") + len(r.get("url") or "") + len(r.get("description") or "") + 200
+        for r in results if isinstance(r, dict)
+    )
+
+async def _json_response(payload: Dict[str, Any]) -> Response:
+    """Encode with orjson, off the event loop when the payload is large"""
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    if _estimate_size(payload) > LARGE_PAYLOAD_BYTES:
+        body = await run_in_threadpool(orjson.dumps, payload, option=options)
+    else:
+        body = orjson.dumps(payload, option=options)
+    return Response(content=body, media_type="application/json")
+
+@router.post("/optimize", response_class=ORJSONResponse)
+async def optimize_payment(request: OptimizationRequest, verbose: bool = False, card_optimizer: CardOptimizer = Depends(get_optimizer)):
+    """Main optimization endpoint with full market analysis (pass ?verbose=1 for raw search results)"""
+    response = await _optimize_cached(request, card_optimizer)
+    if response is None:
+        # Fallbacks are not cached here so the next request retries the live pipeline;
+        # their encoded bodies are memoized by the fallback module
+        return Response(content=get_fallback_recommendation_bytes(request.query), media_type="application/json")
+    return await _json_response(_slim_response(response, verbose))
+
+async def _optimize_cached(request: OptimizationRequest, card_optimizer: CardOptimizer) -> Optional[Dict[str, Any]]:
+    """Serve from the response cache, running the pipeline once per key on a miss; None means use the fallback"""
+    cache_key = _cache_key(request)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"⚡ CACHE HIT: '{request.query}'")
+        return cached
+    
+    task = _inflight.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(_run_and_cache(cache_key, request, card_optimizer))
+        _inflight[cache_key] = task
+        task.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+    else:
+        logger.info(f"⏳ IN-FLIGHT HIT: '{request.query}'")
+    # Shielded so one caller disconnecting doesn't cancel the run for the others
+    return await asyncio.shield(task)
+
+async def _run_and_cache(cache_key: str, request: OptimizationRequest, card_optimizer: CardOptimizer) -> Optional[Dict[str, Any]]:
+    """Run the pipeline once and cache a healthy result"""
+    result = await _run_optimization(request, card_optimizer)
+    # Degraded results go to this run's waiters but aren't cached, so later requests retry the providers
+    if result is not None and not _is_degraded(result):
+        _response_cache[cache_key] = result
+    return result
+
+async def _run_optimization(request: OptimizationRequest, card_optimizer: CardOptimizer) -> Optional[Dict[str, Any]]:
+    """Run the parse -> market search -> recommend pipeline; None means use the fallback"""
     try:
         logger.info(f"🚀 OPTIMIZATION REQUEST: '{request.query}'")
         
-        # Initialize services
-        claude_service = ClaudeService()
-        brave_service = BraveSearchService()
-        card_optimizer = CardOptimizer(claude_service, brave_service, db)
+        claude_service = card_optimizer.claude_service
+        brave_service = card_optimizer.brave_service
+        
+        # Speculatively start market discovery on a guessed category while Claude parses
+        guessed_category = guess_category(request.query)
+        market_task = None
+        if guessed_category:
+            logger.info(f"🔍 STEP 2 (speculative): Searching market for guessed category '{guessed_category}' with Brave...")
+            market_task = asyncio.create_task(brave_service.discover_market_options(guessed_category))
         
         # Parse the transaction
         logger.info("📝 STEP 1: Parsing transaction with Claude...")
-        parsed_transaction = await claude_service.parse_transaction(request.query)
+        try:
+            parsed_transaction = await asyncio.wait_for(
+                claude_service.parse_transaction(request.query), CLAUDE_PARSE_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.error("⏱️ CLAUDE PARSE TIMED OUT")
+            parsed_transaction = None
+        except Exception:
+            if market_task:
+                market_task.cancel()
+            raise
         if not parsed_transaction:
             logger.warning("❌ CLAUDE PARSING FAILED - using fallback")
-            return get_fallback_recommendation(request.query)
+            if market_task:
+                market_task.cancel()
+            return None
         
         logger.info(f"✅ CLAUDE PARSED: {parsed_transaction}")
         
@@ -55,15 +218,38 @@ async def optimize_payment(request: OptimizationRequest, db: Session = Depends(g
         if zero_amount:
             logger.info("ℹ️ Zero-amount transaction detected; continuing market analysis and AI recommendation. Financial impact will use $0-safe messaging.")
         
-        # Get market analysis
+        # Get market analysis, reusing the speculative search when the guess was right
         category = parsed_transaction.get("category", "general")
-        logger.info(f"🔍 STEP 2: Searching market for category '{category}' with Brave...")
+        market_analysis = None
+        if market_task:
+            if category == guessed_category:
+                try:
+                    market_analysis = await asyncio.wait_for(market_task, BRAVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning("⏱️ Speculative market search timed out")
+                    market_analysis = _EMPTY_MARKET_ANALYSIS
+                except Exception as e:
+                    logger.warning(f"Speculative market search failed: {e}")
+            else:
+                logger.info(f"↩️ Guessed category '{guessed_category}' != parsed '{category}'; re-running market search")
+                market_task.cancel()
+        if market_analysis is None:
+            logger.info(f"🔍 STEP 2: Searching market for category '{category}' with Brave...")
+            try:
+                market_analysis = await asyncio.wait_for(
+                    brave_service.discover_market_options(category), BRAVE_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                # A slow search degrades to "no market data" rather than failing the request
+                logger.warning("⏱️ BRAVE MARKET SEARCH TIMED OUT")
+                market_analysis = _EMPTY_MARKET_ANALYSIS
         
-        market_analysis = await brave_service.discover_market_options(category)
-        
-        if market_analysis and market_analysis.get("results"):
-            logger.info(f"✅ BRAVE SEARCH SUCCESS: Found {len(market_analysis.get('results', []))} results from {market_analysis.get('total_sources', 0)} sources")
-            logger.info(f"🔗 BRAVE QUERIES USED: {market_analysis.get('queries_used', [])}")
+        results = market_analysis.get("results") or []
+        total_sources = market_analysis.get("total_sources", 0)
+        queries_used = market_analysis.get("queries_used", [])
+        if results:
+            logger.info(f"✅ BRAVE SEARCH SUCCESS: Found {len(results)} results from {total_sources} sources")
+            logger.info(f"🔗 BRAVE QUERIES USED: {queries_used}")
         else:
             logger.warning("❌ BRAVE SEARCH FAILED OR EMPTY - proceeding with limited data")
         
@@ -71,18 +257,23 @@ async def optimize_payment(request: OptimizationRequest, db: Session = Depends(g
         logger.info("🧠 STEP 3: Generating recommendations with Claude...")
         
         # Extract discovered cards from market analysis
-        discovered_cards = market_analysis.get("results", [])[:10]  # Limit for performance
+        discovered_cards = results[:10]  # Limit for performance
         
         # Create research summary
         research_summary = {
-            "total_sources": market_analysis.get("total_sources", 0),
-            "queries_used": market_analysis.get("queries_used", []),
-            "credible_sources": len([r for r in discovered_cards if r.get("credibility") == "high"])
+            "total_sources": total_sources,
+            "queries_used": queries_used,
+            "credible_sources": sum(1 for r in discovered_cards if r.get("credibility") == "high")
         }
         
-        recommendation = await claude_service.analyze_and_recommend(
-            parsed_transaction, discovered_cards, research_summary
-        )
+        try:
+            recommendation = await asyncio.wait_for(
+                claude_service.analyze_and_recommend(parsed_transaction, discovered_cards, research_summary),
+                CLAUDE_RECOMMEND_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.error("⏱️ CLAUDE RECOMMENDATION TIMED OUT")
+            return None
         
         if recommendation:
             logger.info(f"✅ CLAUDE RECOMMENDATION SUCCESS: Best card = {recommendation.get('best_overall', {}).get('name', 'Unknown')}")
@@ -106,6 +297,6 @@ async def optimize_payment(request: OptimizationRequest, db: Session = Depends(g
         
     except Exception as e:
         logger.error(f"Optimization error: {e}")
-        # Return graceful fallback
-        return get_fallback_recommendation(request.query)
+        # Caller returns graceful fallback
+        return None
 
@@ -4,7 +4,7 @@ Smart Payment Optimization Engine - Main FastAPI Application
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 import os
 import logging
@@ -15,7 +15,7 @@ load_dotenv(find_dotenv())
 
 # Import routers
 from api import optimization
-from database.database import init_db, seed_demo_data
+from database.database import engine, init_db, seed_demo_data
 
 # Configure logging
 logging.basicConfig(
@@ -32,47 +32,48 @@ FRONTEND_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "frontend"))
 async def lifespan(app: FastAPI):
     """Initialize database and seed data on startup"""
     logger.info("Starting Smart Payment Engine...")
-    init_db()
-    seed_demo_data()
+    await init_db()
+    await seed_demo_data()
     logger.info("Database initialized and seeded")
+    await optimization.warmup_services()
     yield
     logger.info("Shutting down Smart Payment Engine...")
+    await optimization.close_services()
+    await engine.dispose()
+
+class RevalidatingStaticFiles(StaticFiles):
+    """Ask browsers to revalidate frontend assets so unchanged files come back as 304s"""
+    
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault("Cache-Control", "no-cache")
+        return response
 
 # Create FastAPI app
 app = FastAPI(
     title="Smart Payment Optimization Engine",
     description="AI-powered credit card optimization for maximum rewards",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
 if os.path.isdir(FRONTEND_DIR):
-    app.mount("/static", StaticFiles(directory=FRONTEND_DIR), name="static")
+    app.mount("/static", RevalidatingStaticFiles(directory=FRONTEND_DIR), name="static")
 
-# Configure CORS for frontend
+# Configure CORS for frontend (comma-separated ALLOWED_ORIGINS; preflights cached for a day)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=[o.strip() for o in os.getenv("ALLOWED_ORIGINS", "http://localhost:8000,http://localhost:3000").split(",") if o.strip()],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
+    max_age=86400,
 )
 
 # Include API routers
 app.include_router(optimization.router, prefix="/api", tags=["optimization"])
 
-@app.get("/")
-async def read_root():
-    return FileResponse(os.path.join(FRONTEND_DIR, 'index.html'))
-
-@app.get("/app.js")
-async def serve_app_js():
-    return FileResponse(os.path.join(FRONTEND_DIR, 'app.js'))
-
-@app.get("/styles.css")
-async def serve_styles_css():
-    return FileResponse(os.path.join(FRONTEND_DIR, 'styles.css'))
-
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -85,12 +86,18 @@ async def health_check():
         }
     }
 
+# Serve index.html, app.js and styles.css (with ETag/Last-Modified); mounted last
+# so it doesn't shadow the API and health routes
+if os.path.isdir(FRONTEND_DIR):
+    app.mount("/", RevalidatingStaticFiles(directory=FRONTEND_DIR, html=True), name="frontend")
+
 # Demo mode exception handler for safe failures
 @app.exception_handler(Exception)
 async def demo_exception_handler(request, exc):
-    """Graceful error handling for demo"""
-    logger.error(f"Demo error: {exc}")
-    return {
+    """Graceful error handling for demo (503 so clients back off instead of retrying a 200)"""
+    # HTTPException and validation errors keep FastAPI's own handlers and status codes
+    logger.exception(f"Demo error: {exc}")
+    return ORJSONResponse(status_code=503, headers={"Retry-After": "5"}, content={
         "error": "Demo mode: showing sample recommendation",
         "recommendation": {
             "best_overall": {
@@ -102,13 +109,24 @@ async def demo_exception_handler(request, exc):
             }
         },
         "note": "This would normally show live market data"
-    }
+    })
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 2))
+    reload = os.getenv("RELOAD", "True").lower() == "true"
+    if reload and workers > 1:
+        # uvicorn can't combine reload with multiple workers; reload wins in development
+        logger.info("RELOAD enabled - running a single worker")
+        workers = 1
     uvicorn.run(
         "main:app",
         host=os.getenv("HOST", "0.0.0.0"),
         port=int(os.getenv("PORT", 8000)),
-        reload=os.getenv("RELOAD", "True").lower() == "true"
+        # uvloop/httptools ship with uvicorn[standard]; uvloop has no Windows build
+        loop="auto" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=workers,
+        reload=reload
     )
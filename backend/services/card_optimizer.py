@@ -1,17 +1,33 @@
 """
 Core card optimization logic
 """
-import json
 import logging
+import re
+from operator import itemgetter
 from typing import Dict, Any, List
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.database import Card
 
 logger = logging.getLogger(__name__)
 
+_RATE_RE = re.compile(r'(\d+(?:\.\d+)?)')
+_POINTS_RE = re.compile(r'point|mile', re.IGNORECASE)
+
+# Recurring-purchase phrases -> (annual multiplier, label)
+_FREQ_RE = re.compile(r'\b(every week|weekly|every month|monthly|every day|daily)\b', re.IGNORECASE)
+_FREQ_MAP = {
+    'every week': (52, " (weekly purchases)"),
+    'weekly': (52, " (weekly purchases)"),
+    'every month': (12, " (monthly purchases)"),
+    'monthly': (12, " (monthly purchases)"),
+    'every day': (365, " (daily purchases)"),
+    'daily': (365, " (daily purchases)"),
+}
+
 class CardOptimizer:
-    def __init__(self, claude_service, brave_service, db: Session):
+    def __init__(self, claude_service, brave_service, db: AsyncSession):
         self.claude_service = claude_service
         self.brave_service = brave_service
         self.db = db
@@ -19,8 +35,10 @@ class CardOptimizer:
     def calculate_reward(self, card: Card, transaction: Dict) -> float:
         """Calculate reward amount for a transaction on a specific card"""
         try:
-            reward_structure = json.loads(card.reward_structure)
             amount = transaction.get("amount", 0)
+            reward_structure = card.reward_structure
+            if not amount or not reward_structure:
+                return 0.0
             category = transaction.get("category", "other")
             
             # Check category-specific rate
@@ -46,25 +64,36 @@ class CardOptimizer:
             logger.error(f"Error calculating reward: {e}")
             return 0.0
     
-    def get_best_card_from_portfolio(self, transaction: Dict) -> Dict:
+    @staticmethod
+    def _reward_rate_expr(category: str):
+        """SQL mirror of calculate_reward's effective rate, so the DB can rank cards"""
+        rs = Card.reward_structure
+        rate = func.coalesce(
+            func.nullif(rs[("categories", category)].as_float(), 0),
+            rs["default_rate"].as_float(),
+            1.0,
+        )
+        point_value = case(
+            (rs["reward_type"].as_string() == "points", func.coalesce(rs["point_value"].as_float(), 0.01)),
+            else_=1.0,
+        )
+        return rate * point_value
+    
+    async def get_best_card_from_portfolio(self, transaction: Dict) -> Dict:
         """Get best card from user's existing portfolio"""
-        cards = self.db.query(Card).filter(Card.is_active == True).all()
+        best_card = await self.db.scalar(
+            select(Card)
+            .where(Card.is_active == True)
+            .order_by(self._reward_rate_expr(transaction.get("category", "other")).desc(), Card.id)
+            .limit(1)
+        )
+        best_reward = self.calculate_reward(best_card, transaction) if best_card else 0
         
-        best_card = None
-        best_reward = 0
-        
-        for card in cards:
-            reward = self.calculate_reward(card, transaction)
-            if reward > best_reward:
-                best_reward = reward
-                best_card = card
-        
-        if best_card:
-            reward_structure = json.loads(best_card.reward_structure)
+        if best_card and best_reward > 0:
             return {
                 "card": best_card,
                 "reward_amount": best_reward,
-                "reward_structure": reward_structure
+                "reward_structure": best_card.reward_structure
             }
         
         return None
@@ -72,24 +101,23 @@ class CardOptimizer:
     def compare_cards(self, cards: List[Dict], transaction: Dict) -> List[Dict]:
         """Compare multiple cards for a transaction"""
         comparisons = []
+        amount = transaction.get("amount", 0)
         
         for card_info in cards:
             # Parse rate to calculate reward
             rate_str = card_info.get("category_rate", "2%")
             
             # Extract numeric rate
-            import re
-            rate_match = re.search(r'(\d+(?:\.\d+)?)', rate_str)
+            rate_match = _RATE_RE.search(rate_str)
             if rate_match:
                 rate = float(rate_match.group(1))
             else:
                 rate = 2.0  # Default 2%
             
             # Check if it's points or cash back
-            is_points = 'point' in rate_str.lower() or 'mile' in rate_str.lower()
+            is_points = bool(_POINTS_RE.search(rate_str))
             
             # Calculate reward
-            amount = transaction.get("amount", 0)
             if is_points:
                 # Points are earned per dollar (e.g., 3x points => 3 points per $1)
                 # Convert points to dollars using average 1.5 cents per point value
@@ -97,17 +125,18 @@ class CardOptimizer:
             else:
                 reward_amount = amount * (rate / 100)
             
+            annual_fee = card_info.get("annual_fee", 0)
             comparisons.append({
                 "card_name": card_info.get("card_name"),
                 "issuer": card_info.get("issuer"),
                 "reward_amount": round(reward_amount, 2),
                 "reward_rate": card_info.get("category_rate"),
-                "annual_fee": card_info.get("annual_fee", 0),
-                "net_value": round(reward_amount - (card_info.get("annual_fee", 0) / 365), 2)  # Daily fee impact
+                "annual_fee": annual_fee,
+                "net_value": round(reward_amount - (annual_fee / 365), 2)  # Daily fee impact
             })
         
         # Sort by reward amount
-        comparisons.sort(key=lambda x: x["reward_amount"], reverse=True)
+        comparisons.sort(key=itemgetter("reward_amount"), reverse=True)
         
         return comparisons
     
@@ -137,19 +166,8 @@ class CardOptimizer:
                 }
             
             # Check for recurring purchase indicators
-            query = transaction.get('original_query', '').lower()
-            frequency_multiplier = 1
-            frequency_text = ""
-            
-            if 'every week' in query or 'weekly' in query:
-                frequency_multiplier = 52
-                frequency_text = " (weekly purchases)"
-            elif 'every month' in query or 'monthly' in query:
-                frequency_multiplier = 12
-                frequency_text = " (monthly purchases)"
-            elif 'every day' in query or 'daily' in query:
-                frequency_multiplier = 365
-                frequency_text = " (daily purchases)"
+            match = _FREQ_RE.search(transaction.get('original_query', ''))
+            frequency_multiplier, frequency_text = _FREQ_MAP[match.group(1).lower()] if match else (1, "")
             
             # Calculate opportunity cost vs basic 2% card
             basic_reward = amount * 0.02
@@ -0,0 +1,37 @@
+"""
+Minimal circuit breaker for external API calls
+"""
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """Skip calls to a provider for `reset_timeout` seconds after `fail_max` consecutive failures"""
+
+    def __init__(self, name: str, fail_max: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self) -> bool:
+        """True if a call should be attempted (closed, or half-open after the reset timeout)"""
+        if self.opened_at is None:
+            return True
+        return time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info(f"Circuit '{self.name}' closed after successful call")
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.fail_max:
+            if self.opened_at is None:
+                logger.warning(f"Circuit '{self.name}' opened after {self.failures} consecutive failures")
+            # (Re)open: a failed half-open trial restarts the cool-down
+            self.opened_at = time.monotonic()
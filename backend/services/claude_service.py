@@ -2,15 +2,331 @@
 Claude API Service for NL parsing and analysis
 """
 import os
+import re
+import copy
 import json
+import hashlib
 import logging
-from typing import Dict, Any, List, Optional
+from functools import partial
+from typing import Callable, Dict, Any, List, Optional, Tuple
 import anthropic
+import httpx
+import orjson
 from anthropic import AsyncAnthropic
 import asyncio
+from cachetools import TTLCache
+from redis import asyncio as aioredis
+
+from services.circuit_breaker import CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
+MODEL = "claude-3-5-haiku-latest"
+
+# How long the shared Redis tier keeps each kind of completion (parses and card
+# extractions change slowly; recommendations depend on fresh market data)
+PARSE_CACHE_TTL = 24 * 3600
+EXTRACT_CACHE_TTL = 6 * 3600
+RECOMMEND_CACHE_TTL = 3600
+
+# Fallback parsing patterns, compiled once; categories are checked in this order
+_AMOUNT_RE = re.compile(r'\$?([\d,]+\.?\d*)')
+_JSON_DECODER = json.JSONDecoder()
+_FALLBACK_CATEGORY_PATTERNS = tuple(
+    (category, re.compile("|".join(map(re.escape, keywords))))
+    for category, keywords in (
+        ("dining", ('starbucks', 'coffee', 'cafe', 'restaurant', 'dining')),
+        ("grocery", ('grocery', 'whole foods', 'walmart', 'target')),
+        ("gas", ('gas', 'shell', 'exxon', 'chevron')),
+        ("travel", ('flight', 'hotel', 'travel', 'trip', 'airline')),
+    )
+)
+_RECURRING_RE = re.compile(r'every|weekly|monthly|daily|recurring|regular', re.IGNORECASE)
+_FREQUENCY_RE = re.compile(r'\b(every week|weekly|every month|monthly|every day|daily)\b', re.IGNORECASE)
+_FREQUENCY_MAP = {'every week': 52, 'weekly': 52, 'every month': 12, 'monthly': 12, 'every day': 365, 'daily': 365}
+_FALLBACK_MERCHANTS = {"dining": ('starbucks', "Starbucks"), "grocery": ('whole foods', "Whole Foods")}
+
+class _JsonEndDetector:
+    """Incrementally finds where the first top-level JSON object/array in streamed text closes
+
+    With an opener ('{' or '['), brackets in any prose before that character are ignored.
+    """
+    
+    def __init__(self, opener: Optional[str] = None):
+        self.openers = opener or "{["
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+    
+    def feed(self, chunk: str) -> Optional[int]:
+        """Consume a chunk; return the index just past the closing bracket once found"""
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch in ("{[" if self.depth else self.openers):
+                self.depth += 1
+            elif ch in "}]" and self.depth:
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+            elif ch == '"' and self.depth:
+                self.in_string = True
+        return None
+
+# Static recommendation rubric, sent as the system prompt; only the transaction data varies per call.
+# Claude reports each card's rates as data; rewards, net values and ranking are computed in Python.
+_ANALYZE_SYSTEM = """You are an expert financial advisor. Based on the transaction details and market research data, identify the best credit cards for this purchase.
+
+For each candidate card, report its earn rate for this purchase's category as data. Do NOT calculate reward amounts, net values or rankings - those are computed from your numbers.
+
+Consider:
+1. Reward rates for this specific category (distinguish standard rates from temporary promotions)
+2. Annual fees
+3. Signup bonuses and current offers
+4. Merchant category considerations
+5. Spending caps and limitations (especially for high % cards like 5% with monthly caps)
+
+IMPORTANT: Return ONLY valid JSON, no other text. Use this exact format:
+{
+    "cards": [
+        {
+            "name": "card name",
+            "issuer": "bank name",
+            "reward_rate": "rate description, e.g. 4% cash back on dining",
+            "rate_number": number,
+            "reward_kind": "cash" or "points",
+            "point_value": dollars_per_point,
+            "annual_fee": fee_amount,
+            "signup_bonus": "bonus description if available",
+            "ai_reasoning": "why this card suits this purchase",
+            "data_source": "specific URL or source where this info was found"
+        }
+    ],
+    "data_freshness": "how recent the market data is"
+}
+
+RULES:
+- List 3 to 5 distinct cards
+- rate_number must be a NUMBER: the percentage for cash back (4 for 4%), or points/miles earned per dollar (3 for 3x)
+- point_value must be a NUMBER in dollars, only for points/miles. Use realistic values: Chase UR ~0.015, Amex MR ~0.018, airline miles ~0.012, hotel points ~0.006
+- annual_fee must be a NUMBER in dollars (0 if none)"""
+
+# Canned data for the no-API fallbacks, built once at import
+_FALLBACK_CARDS = {
+    "dining": (
+        {
+            "card_name": "Capital One Savor",
+            "issuer": "Capital One",
+            "category_rate": "4% cash back",
+            "annual_fee": 95,
+            "spending_cap": None,
+            "promotional_offers": "$300 bonus after $3k spend",
+            "source_quality": "high"
+        },
+        {
+            "card_name": "Chase Sapphire Preferred",
+            "issuer": "Chase",
+            "category_rate": "3x points",
+            "annual_fee": 95,
+            "spending_cap": None,
+            "promotional_offers": "60k points after $4k spend",
+            "source_quality": "high"
+        }
+    ),
+    "grocery": (
+        {
+            "card_name": "Amex Blue Cash Preferred",
+            "issuer": "American Express",
+            "category_rate": "6% cash back",
+            "annual_fee": 95,
+            "spending_cap": "$6,000/year",
+            "promotional_offers": "$350 after $3k spend",
+            "source_quality": "high"
+        },
+        {
+            "card_name": "Amex Gold Card",
+            "issuer": "American Express",
+            "category_rate": "4x points",
+            "annual_fee": 250,
+            "spending_cap": "$25,000/year",
+            "promotional_offers": "90k points after $6k spend",
+            "source_quality": "high"
+        }
+    ),
+    "travel": (
+        {
+            "card_name": "Capital One Venture X",
+            "issuer": "Capital One",
+            "category_rate": "2x miles on everything",
+            "annual_fee": 395,
+            "spending_cap": None,
+            "promotional_offers": "75k miles after $4k spend",
+            "source_quality": "high"
+        },
+        {
+            "card_name": "Chase Sapphire Reserve",
+            "issuer": "Chase",
+            "category_rate": "3x points",
+            "annual_fee": 550,
+            "spending_cap": None,
+            "promotional_offers": "60k points after $4k spend",
+            "source_quality": "high"
+        }
+    )
+}
+_DEFAULT_FALLBACK_CARDS = (
+    {
+        "card_name": "Citi Double Cash",
+        "issuer": "Citi",
+        "category_rate": "2% cash back",
+        "annual_fee": 0,
+        "spending_cap": None,
+        "promotional_offers": "$200 after $1.5k spend",
+        "source_quality": "medium"
+    },
+)
+
+_FALLBACK_RECOMMENDATIONS = {
+    "dining": {
+        "best_overall": {
+            "name": "Capital One Savor",
+            "reward_rate": "4% cash back on dining",
+            "annual_fee": 95,
+            "signup_bonus": "$300 after $3k spend",
+            "ai_reasoning": "Highest flat dining cash back rate available"
+        },
+        "runner_up": {
+            "name": "Chase Sapphire Preferred",
+            "reward_rate": "3x points on dining",
+            "annual_fee": 95,
+            "ai_reasoning": "Better for travel redemptions"
+        }
+    },
+    "grocery": {
+        "best_overall": {
+            "name": "Amex Blue Cash Preferred",
+            "reward_rate": "6% cash back on groceries",
+            "annual_fee": 95,
+            "signup_bonus": "$350 after $3k spend",
+            "ai_reasoning": "Highest grocery cash back rate in market"
+        },
+        "runner_up": {
+            "name": "Amex Gold Card",
+            "reward_rate": "4x points on groceries",
+            "annual_fee": 250,
+            "ai_reasoning": "Better for premium travel redemptions"
+        }
+    }
+}
+_DEFAULT_FALLBACK_RECOMMENDATION = {
+    "best_overall": {
+        "name": "Citi Double Cash",
+        "reward_rate": "2% cash back on everything",
+        "annual_fee": 0,
+        "signup_bonus": "$200 after $1.5k spend",
+        "ai_reasoning": "Best general purpose cash back card"
+    },
+    "runner_up": {
+        "name": "Chase Freedom Unlimited",
+        "reward_rate": "1.5% cash back",
+        "annual_fee": 0,
+        "ai_reasoning": "No annual fee option"
+    }
+}
+# Reward dollars per purchase dollar for the fallback cards above (points valued at 1.5c)
+_FALLBACK_REWARD_RATES = {
+    "Capital One Savor": 0.04,
+    "Chase Sapphire Preferred": 3 * 0.015,
+    "Amex Blue Cash Preferred": 0.06,
+    "Amex Gold Card": 4 * 0.015,
+    "Citi Double Cash": 0.02,
+    "Chase Freedom Unlimited": 0.015,
+}
+
+def _extract_json_object(text: str) -> Any:
+    """Decode the JSON object starting at the first '{', ignoring any surrounding prose"""
+    start = text.find("{")
+    if start < 0:
+        raise json.JSONDecodeError("No JSON object found", text, 0)
+    obj, _ = _JSON_DECODER.raw_decode(text, start)
+    return obj
+
+def _loads_checked(text: str, kind: type, embedded: bool = False) -> Any:
+    """Decode a completion as JSON with the expected top-level type (ValueError if it isn't)"""
+    try:
+        value = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        if not embedded:
+            raise
+        # Decode the first JSON object within the response (in case Claude adds extra text)
+        value = _extract_json_object(text)
+    if not isinstance(value, kind):
+        raise ValueError(f"Expected a JSON {kind.__name__}, got {type(value).__name__}")
+    return value
+
+# Completion decoders; a reply is only cached once its decoder accepts it
+_decode_object = partial(_loads_checked, kind=dict)
+_decode_array = partial(_loads_checked, kind=list)
+_decode_embedded_object = partial(_loads_checked, kind=dict, embedded=True)
+# Bracket each decoder's JSON value opens with, so the streaming early stop skips leading prose
+_DECODER_OPENERS = {_decode_object: "{", _decode_array: "[", _decode_embedded_object: "{"}
+
+# Prompt budget for search results passed to card extraction
+RESULTS_TEXT_BUDGET = 6000
+RESULT_DESCRIPTION_CHARS = 500
+
+def _pack_results(results: List[Dict], budget: int = RESULTS_TEXT_BUDGET,
+                  per_desc: int = RESULT_DESCRIPTION_CHARS) -> str:
+    """Join result titles/descriptions until the character budget is used up"""
+    chunks = []
+    used = 0
+    for r in results:
+        chunk = f"Source: {(r.get('title') or '')[:200]}\n{(r.get('description') or '')[:per_desc]}"
+        if used + len(chunk) > budget:
+            break
+        chunks.append(chunk)
+        used += len(chunk) + 1
+    return "\n".join(chunks)
+
+def _rank_cards(cards: List[Dict], amount: float, frequency: int) -> List[Tuple[float, Dict]]:
+    """Compute each card's reward for the purchase and return (net value, card) pairs, best first"""
+    ranked = []
+    for card in cards:
+        if not isinstance(card, dict) or not card.get("name"):
+            continue
+        try:
+            rate = float(card.get("rate_number") or 0)
+            fee = float(card.get("annual_fee") or 0)
+            if card.get("reward_kind") == "points":
+                point_value = float(card.get("point_value") or 0.015)
+                reward = round(amount * rate * point_value, 2)
+                logic = f"${amount:.2f} × {rate:g} points × ${point_value:g}/point = ${reward:.2f}"
+            else:
+                reward = round(amount * rate / 100, 2)
+                logic = f"${amount:.2f} × {rate:g}% = ${reward:.2f} cash back"
+        except (TypeError, ValueError):
+            continue
+        entry = {
+            "name": card["name"],
+            "issuer": card.get("issuer"),
+            "reward_amount": reward,
+            "reward_rate": card.get("reward_rate") or "",
+            "annual_fee": fee,
+            "signup_bonus": card.get("signup_bonus"),
+            "ai_reasoning": card.get("ai_reasoning", ""),
+            "calculation_logic": logic,
+            "data_source": card.get("data_source"),
+        }
+        ranked.append((reward * frequency - fee, entry))
+    # Stable sort: ties keep Claude's order
+    ranked.sort(key=lambda pair: (pair[0], pair[1]["reward_amount"]), reverse=True)
+    return ranked
+
 class ClaudeService:
     def __init__(self):
         api_key = os.getenv("CLAUDE_API_KEY")
@@ -18,12 +334,139 @@ class ClaudeService:
             logger.warning("Claude API key not configured - using fallback mode")
             self.client = None
         else:
-            self.client = AsyncAnthropic(api_key=api_key)
+            # Explicit keep-alive pool with HTTP/2 so concurrent calls share a few connections.
+            # The SDK retries connection errors, 408/409/429 and 5xx with jittered exponential
+            # backoff; the per-call deadline in _complete() bounds the total time spent retrying.
+            self.client = AsyncAnthropic(
+                api_key=api_key,
+                max_retries=2,
+                http_client=httpx.AsyncClient(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60),
+                    timeout=httpx.Timeout(15.0, connect=3.0)
+                )
+            )
+        # Short-circuit to fallbacks while the API is failing repeatedly
+        self.breaker = CircuitBreaker("claude")
+        # Raw completion text keyed by (model, max_tokens, prompt); all calls use temperature 0
+        self._cache: TTLCache = TTLCache(maxsize=2048, ttl=3600)
+        # Caps concurrent API calls per process so batches stay under the account's rate limit
+        self._sem = asyncio.Semaphore(int(os.getenv("CLAUDE_MAX_CONCURRENCY", "10")))
+        # Optional Redis tier so completions survive restarts and are shared across workers
+        redis_url = os.getenv("REDIS_URL")
+        self._redis = aioredis.from_url(redis_url, socket_timeout=0.5) if redis_url else None
+    
+    async def warmup(self):
+        """Open pooled API and Redis connections so the first request skips the handshakes"""
+        if self._redis is not None:
+            try:
+                async with asyncio.timeout(2):
+                    await self._redis.ping()
+                logger.info("Claude Redis cache connection warmed up")
+            except Exception as e:
+                logger.warning(f"Claude Redis cache warmup failed: {e}")
+        if not self.client:
+            return
+        try:
+            async with asyncio.timeout(3):
+                await self.client._client.head(str(self.client.base_url))
+            logger.info("Claude API connection warmed up")
+        except Exception as e:
+            logger.warning(f"Claude API warmup failed: {e}")
+    
+    async def aclose(self):
+        """Close the underlying HTTP client and Redis connection"""
+        if self.client:
+            await self.client.close()
+        if self._redis is not None:
+            await self._redis.aclose()
+    
+    async def _complete(self, prompt: str, max_tokens: int, timeout: float, system: Optional[str] = None,
+                        ttl: int = 3600, decode: Callable[[str], Any] = _decode_object) -> Any:
+        """Return the decoded completion for a prompt, from cache or a single API call
+
+        Only replies that decode are cached (Redis keeps them for ttl seconds), so a truncated
+        or malformed reply isn't replayed to every later identical request.
+        """
+        cache_key = hashlib.blake2b(
+            f"{MODEL}\x00{max_tokens}\x00{system or ''}\x00{prompt}".encode(), digest_size=16
+        ).hexdigest()
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            logger.info("⚡ CLAUDE CACHE HIT")
+            return decode(cached)
+        
+        redis_key = f"claude:{cache_key}"
+        if self._redis is not None:
+            try:
+                cached = await self._redis.get(redis_key)
+            except Exception as e:
+                logger.warning(f"Redis cache unavailable: {e}")
+            if cached is not None:
+                try:
+                    text = cached.decode()
+                    value = decode(text)
+                except ValueError:
+                    # Left by a worker that cached replies unchecked; drop it and ask the API again
+                    logger.warning("Discarding undecodable Claude reply from Redis")
+                    try:
+                        await self._redis.delete(redis_key)
+                    except Exception as e:
+                        logger.warning(f"Redis cache delete failed: {e}")
+                else:
+                    logger.info("⚡ CLAUDE REDIS HIT")
+                    self._cache[cache_key] = text
+                    return value
+        
+        # Stream the reply and stop reading as soon as the JSON value closes, so any trailing
+        # prose isn't waited for. asyncio.timeout cancels in place without an extra task.
+        chunks = []
+        detector = _JsonEndDetector(_DECODER_OPENERS.get(decode))
+        async with self._sem, asyncio.timeout(timeout):
+            async with self.client.messages.stream(
+                model=MODEL,
+                max_tokens=max_tokens,
+                temperature=0,
+                messages=[{"role": "user", "content": prompt}],
+                **({"system": system} if system else {})
+            ) as stream:
+                async for delta in stream.text_stream:
+                    end = detector.feed(delta)
+                    if end is not None:
+                        chunks.append(delta[:end])
+                        break
+                    chunks.append(delta)
+        self.breaker.record_success()
+        text = "".join(chunks)
+        try:
+            value = decode(text)
+        except ValueError:
+            logger.error(f"Undecodable Claude reply (not cached): {text[:500]}")
+            raise
+        self._cache[cache_key] = text
+        if self._redis is not None:
+            try:
+                await self._redis.set(redis_key, text, ex=ttl)
+            except Exception as e:
+                logger.warning(f"Redis cache write failed: {e}")
+        return value
     
     async def parse_transaction(self, query: str) -> Dict[str, Any]:
         """Parse natural language transaction into structured data"""
         
-        if not self.client:
+        # Fast path: a known merchant with an explicit dollar amount needs no LLM call
+        amount_match = _AMOUNT_RE.search(query)
+        if amount_match and amount_match.group(0).startswith('$'):
+            pre = self._fallback_parse(query)
+            if pre["merchant"] != "Unknown" and pre["category"] != "other" and pre["amount"] > 0:
+                del pre["is_fallback"]  # deterministic, not a degraded result
+                pre["confidence"] = 0.9
+                pre["ai_reasoning"] = "Fast-path deterministic parse"
+                pre["original_query"] = query
+                logger.info(f"Parsed transaction (fast path): {pre}")
+                return pre
+        
+        if not self.client or not self.breaker.allow():
             # Fallback parsing without API
             return self._fallback_parse(query)
         
@@ -47,38 +490,34 @@ Examples:
 """
         
         try:
-            response = await asyncio.wait_for(self.client.messages.create(
-                model="claude-3-5-haiku-latest",
-                max_tokens=500,
-                temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            ), timeout=8)
-            
-            # Parse JSON from response
-            result = json.loads(response.content[0].text)
+            result = await self._complete(prompt, max_tokens=500, timeout=8, ttl=PARSE_CACHE_TTL)
             result['confidence'] = result.get('confidence', 0.95)
             result['original_query'] = query  # Store original query for recurring detection
             logger.info(f"Parsed transaction: {result}")
             return result
             
         except asyncio.TimeoutError:
+            self.breaker.record_failure()
             logger.error("Claude API timeout during parse_transaction; using fallback parse")
             return self._fallback_parse(query)
         except Exception as e:
+            if isinstance(e, anthropic.APIError):
+                self.breaker.record_failure()
             logger.error(f"Claude API error: {e}")
             return self._fallback_parse(query)
     
+    async def parse_transactions(self, queries: List[str]) -> List[Dict[str, Any]]:
+        """Parse several transactions concurrently, in input order"""
+        return await asyncio.gather(*(self.parse_transaction(q) for q in queries))
+    
     async def extract_discovered_cards(self, discovery_results: List[Dict], category: str) -> List[Dict]:
         """Extract specific credit cards from market discovery results"""
         
-        if not self.client:
+        if not self.client or not self.breaker.allow():
             return self._fallback_cards(category)
         
-        # Combine discovery results into text
-        results_text = "\n".join([
-            f"Source: {r.get('title', '')}\n{r.get('description', '')}"
-            for r in discovery_results[:10]
-        ])
+        # Combine discovery results into text, within a fixed size budget
+        results_text = _pack_results(discovery_results)
         
         prompt = f"""Analyze these market research results about {category} credit cards and extract specific card options:
 
@@ -102,210 +541,64 @@ Only include cards with specific {category} rewards. Focus on major issuers (Cha
 Be precise about rates - distinguish between temporary promotional rates and standard rates."""
         
         try:
-            response = await asyncio.wait_for(self.client.messages.create(
-                model="claude-3-5-haiku-latest",
-                max_tokens=1000,
-                temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            ), timeout=10)
-            
-            result = json.loads(response.content[0].text)
+            result = await self._complete(prompt, max_tokens=1000, timeout=10, ttl=EXTRACT_CACHE_TTL,
+                                          decode=_decode_array)
             logger.info(f"Extracted {len(result)} cards from discovery")
             return result
             
         except asyncio.TimeoutError:
+            self.breaker.record_failure()
             logger.error("Claude API timeout during extract_discovered_cards; using fallback cards")
             return self._fallback_cards(category)
         except Exception as e:
+            if isinstance(e, anthropic.APIError):
+                self.breaker.record_failure()
             logger.error(f"Card extraction error: {e}")
             return self._fallback_cards(category)
     
     async def analyze_and_recommend(self, transaction: Dict, discovered_cards: List[Dict], research: Dict) -> Dict:
         """Provide final AI financial analysis and recommendation"""
         
-        if not self.client:
+        if not self.client or not self.breaker.allow():
             return self._fallback_recommendation(transaction)
         
-        # Check for recurring purchase indicators
-        query_lower = transaction.get('original_query', '').lower()
-        is_recurring = any(term in query_lower for term in ['every', 'weekly', 'monthly', 'daily', 'recurring', 'regular'])
-        frequency_multiplier = 1
-        if 'every week' in query_lower or 'weekly' in query_lower:
-            frequency_multiplier = 52
-        elif 'every month' in query_lower or 'monthly' in query_lower:
-            frequency_multiplier = 12
-        elif 'every day' in query_lower or 'daily' in query_lower:
-            frequency_multiplier = 365
+        # Check for recurring purchase indicators (computed once, reused when ranking below)
+        original_query = transaction.get('original_query', '')
+        is_recurring = _RECURRING_RE.search(original_query) is not None
+        match = _FREQUENCY_RE.search(original_query)
+        frequency_multiplier = _FREQUENCY_MAP[match.group(1).lower()] if match else 1
         
-        prompt = f"""You are an expert financial advisor. Based on the transaction details and market research data, analyze and recommend the best credit cards.
-
-Transaction: {json.dumps(transaction)}
-Discovered Cards: {json.dumps(discovered_cards[:5])}  
-Research Summary: {json.dumps(research)}
-{f"Recurring Purchase: Yes, estimated {frequency_multiplier} times per year" if is_recurring else ""}
-
-CRITICAL EVALUATION CRITERIA - FOLLOW THESE RULES EXACTLY:
-1. Calculate reward amount for EACH card
-2. Compare: Card A gives ${transaction.get('amount', 0) * 0.05:.2f} with $0 fee vs Card B gives ${transaction.get('amount', 0) * 0.03:.2f} with $95 fee
-3. For single purchases: The card with HIGHER REWARD AMOUNT and LOWER/NO FEE wins
-4. For recurring purchases: Calculate (reward_per_transaction * {frequency_multiplier}) - annual_fee
-5. **IMPORTANT**: If Card A gives 5% ($2.25) with $0 fee and Card B gives 3% ($1.35) with $95 fee, Card A MUST be "best_overall"
-6. The "best_overall" MUST be the card that gives the user the MOST MONEY BACK considering fees
-
-Consider:
-1. Reward rates for this specific category
-2. Annual fees vs benefits (CRITICAL: Don't recommend high fee cards unless rewards justify it)
-3. Signup bonuses and current offers
-4. Merchant category considerations
-5. Spending caps and limitations (especially for high % cards like 5% with monthly caps)
-
-IMPORTANT: Return ONLY valid JSON, no other text. Use this exact format:
-{{
-    "best_overall": {{
-        "name": "card name",
-        "reward_amount": calculated_reward_in_dollars,
-        "reward_rate": "rate description",
-        "annual_fee": fee_amount,
-        "signup_bonus": "bonus description if available",
-        "ai_reasoning": "why this is best for this purchase",
-        "calculation_logic": "show the math: e.g., $5.50 × 4% = $0.22 cash back OR $5.50 × 3 points × $0.015/point = $0.25",
-        "data_source": "specific URL or source where this info was found"
-    }},
-    "runner_up": {{
-        "name": "card name",
-        "reward_amount": calculated_reward_in_dollars,
-        "reward_rate": "rate description",
-        "annual_fee": fee_amount,
-        "ai_reasoning": "why this is second best",
-        "calculation_logic": "show the math for this card",
-        "data_source": "specific URL or source where this info was found"
-    }},
-    "alternative": {{
-        "name": "card name",
-        "reward_amount": calculated_reward_in_dollars,
-        "reward_rate": "rate description",
-        "annual_fee": fee_amount,
-        "ai_reasoning": "why this is a good alternative option",
-        "calculation_logic": "show the math for this card",
-        "data_source": "specific URL or source where this info was found"
-    }},
-    "opportunity_cost": "comparison to average 2% card",
-    "annual_projection": "NOT about future earnings - focus on comparison to other cards",
-    "data_freshness": "how recent the market data is"
-}}
-
-CRITICAL: For reward calculations:
-- Cash back: multiply purchase amount by percentage (e.g., $100 × 4% = $4.00)
-- Points: multiply purchase amount by points rate, then by point value (e.g., $100 × 3 points × $0.01/point = $3.00)
-- Use realistic point values: Chase UR ~1.5¢, Amex MR ~1.8¢, airline miles ~1.2¢, hotel points ~0.6¢
-- Always show your calculation in calculation_logic field
-- For "best_overall": MUST be the card with highest net value (rewards minus fees)
-- EXAMPLE: 5% back with $0 fee ALWAYS beats 3% back with $95 fee for gas purchases
-- DO NOT recommend high annual fee cards as "best" unless the rewards FAR exceed the fee
-- The runner_up should be the second-best option, not the best option
-- IMPORTANT: reward_amount must be a NUMBER, not a formula. Calculate the actual value."""
+        prompt = f"""Transaction: {orjson.dumps(transaction).decode()}
+Discovered Cards: {orjson.dumps(discovered_cards[:5]).decode()}
+Research Summary: {orjson.dumps(research).decode()}
+{f"Recurring Purchase: Yes, estimated {frequency_multiplier} times per year" if is_recurring else ""}"""
         
         try:
-            response = await asyncio.wait_for(self.client.messages.create(
-                model="claude-3-5-haiku-latest",
-                max_tokens=1000,
-                temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            ), timeout=12)
+            parsed = await self._complete(prompt, max_tokens=1000, timeout=12, system=_ANALYZE_SYSTEM,
+                                          ttl=RECOMMEND_CACHE_TTL, decode=_decode_embedded_object)
             
-            response_text = response.content[0].text
-            logger.info(f"Claude response: {response_text[:200]}...")
-            
-            # Try to extract JSON from response (in case Claude adds extra text)
+            # Rank deterministically by annual net value: reward per purchase x purchases per year - fee
             try:
-                result = json.loads(response_text)
-            except json.JSONDecodeError:
-                # Try to find JSON within the response
-                import re
-                json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                if json_match:
-                    result = json.loads(json_match.group())
-                else:
-                    raise
-            
-            # Ensure consistent field naming and add missing fields
-            if result.get("best_overall"):
-                # Rename 'name' to 'card_name' for consistency
-                if "name" in result["best_overall"] and "card_name" not in result["best_overall"]:
-                    result["best_overall"]["card_name"] = result["best_overall"]["name"]
-                # Rename 'reward_amount' to 'reward_value' for consistency
-                if "reward_amount" in result["best_overall"] and "reward_value" not in result["best_overall"]:
-                    result["best_overall"]["reward_value"] = result["best_overall"]["reward_amount"]
-                # Add source attribution if missing
-                if not result["best_overall"].get("data_source"):
-                    result["best_overall"]["data_source"] = f"Live market data from {len(discovered_cards)} sources"
-            
-            if result.get("runner_up"):
-                # Rename 'name' to 'card_name' for consistency
-                if "name" in result["runner_up"] and "card_name" not in result["runner_up"]:
-                    result["runner_up"]["card_name"] = result["runner_up"]["name"]
-                # Rename 'reward_amount' to 'reward_value' for consistency
-                if "reward_amount" in result["runner_up"] and "reward_value" not in result["runner_up"]:
-                    result["runner_up"]["reward_value"] = result["runner_up"]["reward_amount"]
-                # Add source attribution if missing
-                if not result["runner_up"].get("data_source"):
-                    result["runner_up"]["data_source"] = f"Live market data from {len(discovered_cards)} sources"
-            
-            if result.get("alternative"):
-                # Rename 'name' to 'card_name' for consistency
-                if "name" in result["alternative"] and "card_name" not in result["alternative"]:
-                    result["alternative"]["card_name"] = result["alternative"]["name"]
-                # Rename 'reward_amount' to 'reward_value' for consistency
-                if "reward_amount" in result["alternative"] and "reward_value" not in result["alternative"]:
-                    result["alternative"]["reward_value"] = result["alternative"]["reward_amount"]
-                # Add source attribution if missing
-                if not result["alternative"].get("data_source"):
-                    result["alternative"]["data_source"] = f"Live market data from {len(discovered_cards)} sources"
-            
-            # Post-process to ensure correct card ordering based on net value
-            best = result.get("best_overall", {})
-            runner = result.get("runner_up", {})
-            
-            # Calculate net values for comparison
-            best_reward = best.get("reward_amount", 0)
-            best_fee = best.get("annual_fee", 0)
-            runner_reward = runner.get("reward_amount", 0) 
-            runner_fee = runner.get("annual_fee", 0)
-            
-            # Check for recurring purchases
-            query_lower = transaction.get('original_query', '').lower()
-            frequency = 1
-            if 'every week' in query_lower or 'weekly' in query_lower:
-                frequency = 52
-            elif 'every month' in query_lower or 'monthly' in query_lower:
-                frequency = 12
-            elif 'every day' in query_lower or 'daily' in query_lower:
-                frequency = 365
+                amount = float(transaction.get("amount") or 0)
+            except (TypeError, ValueError):
+                amount = 0.0
+            ranked = _rank_cards(parsed.get("cards") or [], amount, frequency_multiplier)
+            if not ranked:
+                logger.warning("Claude returned no usable cards; using fallback recommendation")
+                return self._fallback_recommendation(transaction)
             
-            # Calculate annual net value
-            best_net = (best_reward * frequency) - best_fee
-            runner_net = (runner_reward * frequency) - runner_fee
+            result = {"data_freshness": parsed.get("data_freshness", "")}
+            for slot, (_, entry) in zip(("best_overall", "runner_up", "alternative"), ranked):
+                result[slot] = self._normalize_card(entry, len(discovered_cards))
             
-            # Swap if runner-up is actually better
-            if runner_net > best_net and runner_reward > 0:
-                result["best_overall"], result["runner_up"] = result["runner_up"], result["best_overall"]
-                # Update reasoning
-                result["best_overall"]["ai_reasoning"] = f"Higher net value: ${runner_reward:.2f} per transaction with ${runner_fee} annual fee beats ${best_reward:.2f} with ${best_fee} fee"
-                result["runner_up"]["ai_reasoning"] = "Lower net value despite good rewards"
-            
-            # Ensure consistent field naming and add missing fields
-            if result.get("best_overall"):
-                # Add card_name and reward_value for consistency
-                result["best_overall"]["card_name"] = result["best_overall"].get("name", "Unknown Card")
-                result["best_overall"]["reward_value"] = result["best_overall"].get("reward_amount", 0)
-                
-            if result.get("runner_up"):
-                result["runner_up"]["card_name"] = result["runner_up"].get("name", "Unknown Card")
-                result["runner_up"]["reward_value"] = result["runner_up"].get("reward_amount", 0)
-            
-            if result.get("alternative"):
-                result["alternative"]["card_name"] = result["alternative"].get("name", "Unknown Card")
-                result["alternative"]["reward_value"] = result["alternative"].get("reward_amount", 0)
+            best_net, best = ranked[0]
+            result["opportunity_cost"] = f"${max(0.0, best['reward_amount'] - amount * 0.02):.2f} more than an average 2% card"
+            if len(ranked) > 1:
+                runner_net, runner = ranked[1]
+                per = "per year" if frequency_multiplier > 1 else "on this purchase"
+                result["annual_projection"] = f"${best_net - runner_net:.2f} more than {runner['name']} {per}, after annual fees"
+            else:
+                result["annual_projection"] = ""
             
             # Add top-level fields for easier access
             if result.get("best_overall"):
@@ -314,7 +607,7 @@ CRITICAL: For reward calculations:
                 result["calculation_logic"] = result["best_overall"].get("calculation_logic", "")
                 result["data_source"] = result["best_overall"].get("data_source", "AI Analysis")
                 result["reward_rate"] = result["best_overall"].get("reward_rate", "")
-                result["calculation_method"] = "AI-analyzed market rates × purchase amount"
+                result["calculation_method"] = "Market rates × purchase amount, ranked by net value after fees"
             
             # Ensure source attribution
             if "data_source" not in result:
@@ -325,16 +618,31 @@ CRITICAL: For reward calculations:
             return result
             
         except asyncio.TimeoutError:
+            self.breaker.record_failure()
             logger.error("Claude API timeout during analyze_and_recommend; using fallback recommendation")
             return self._fallback_recommendation(transaction)
-        except json.JSONDecodeError as e:
+        except ValueError as e:  # JSON decode errors, including orjson's, and wrong-shape replies
             logger.error(f"JSON decode error: {e}")
-            logger.error(f"Raw response: {response_text[:500]}")
             return self._fallback_recommendation(transaction)
         except Exception as e:
+            if isinstance(e, anthropic.APIError):
+                self.breaker.record_failure()
             logger.error(f"Recommendation error: {e}")
             return self._fallback_recommendation(transaction)
     
+    @staticmethod
+    def _normalize_card(entry: Dict, n_sources: int) -> Dict:
+        """Add the card_name / reward_value aliases and a default data_source to a recommended card"""
+        entry["card_name"] = entry.get("name", "Unknown Card")
+        entry["reward_value"] = entry.get("reward_amount", 0)
+        if not entry.get("data_source"):
+            entry["data_source"] = f"Live market data from {n_sources} sources"
+        return entry
+    
+    async def analyze_and_recommend_many(self, items: List[Tuple[Dict, List[Dict], Dict]]) -> List[Dict]:
+        """Run analyze_and_recommend for several (transaction, discovered_cards, research) tuples concurrently"""
+        return await asyncio.gather(*(self.analyze_and_recommend(*item) for item in items))
+    
     def _fallback_parse(self, user_input: str) -> Dict[str, Any]:
         """Fallback parsing without API"""
         # Simple keyword-based parsing
@@ -343,26 +651,20 @@ CRITICAL: For reward calculations:
         category = "other"
         
         # Extract amount
-        import re
-        amount_match = re.search(r'\$?([\d,]+\.?\d*)', user_input)
+        amount_match = _AMOUNT_RE.search(user_input)
         if amount_match:
             amount = float(amount_match.group(1).replace(',', ''))
         
         # Detect category and merchant
         input_lower = user_input.lower()
         
-        if any(word in input_lower for word in ['starbucks', 'coffee', 'cafe', 'restaurant', 'dining']):
-            category = "dining"
-            if 'starbucks' in input_lower:
-                merchant = "Starbucks"
-        elif any(word in input_lower for word in ['grocery', 'whole foods', 'walmart', 'target']):
-            category = "grocery"
-            if 'whole foods' in input_lower:
-                merchant = "Whole Foods"
-        elif any(word in input_lower for word in ['gas', 'shell', 'exxon', 'chevron']):
-            category = "gas"
-        elif any(word in input_lower for word in ['flight', 'hotel', 'travel', 'trip', 'airline']):
-            category = "travel"
+        for candidate, pattern in _FALLBACK_CATEGORY_PATTERNS:
+            if pattern.search(input_lower):
+                category = candidate
+                keyword, name = _FALLBACK_MERCHANTS.get(candidate, (None, None))
+                if keyword and keyword in input_lower:
+                    merchant = name
+                break
         
         return {
             "merchant": merchant,
@@ -370,172 +672,30 @@ CRITICAL: For reward calculations:
             "category": category,
             "confidence": 0.7,
             "extracted_context": ["Parsed without API"],
-            "ai_reasoning": "Fallback keyword-based parsing"
+            "ai_reasoning": "Fallback keyword-based parsing",
+            "is_fallback": True
         }
     
     def _fallback_cards(self, category: str) -> List[Dict]:
         """Fallback card recommendations by category"""
-        cards_by_category = {
-            "dining": [
-                {
-                    "card_name": "Capital One Savor",
-                    "issuer": "Capital One",
-                    "category_rate": "4% cash back",
-                    "annual_fee": 95,
-                    "spending_cap": None,
-                    "promotional_offers": "$300 bonus after $3k spend",
-                    "source_quality": "high"
-                },
-                {
-                    "card_name": "Chase Sapphire Preferred",
-                    "issuer": "Chase",
-                    "category_rate": "3x points",
-                    "annual_fee": 95,
-                    "spending_cap": None,
-                    "promotional_offers": "60k points after $4k spend",
-                    "source_quality": "high"
-                }
-            ],
-            "grocery": [
-                {
-                    "card_name": "Amex Blue Cash Preferred",
-                    "issuer": "American Express",
-                    "category_rate": "6% cash back",
-                    "annual_fee": 95,
-                    "spending_cap": "$6,000/year",
-                    "promotional_offers": "$350 after $3k spend",
-                    "source_quality": "high"
-                },
-                {
-                    "card_name": "Amex Gold Card",
-                    "issuer": "American Express",
-                    "category_rate": "4x points",
-                    "annual_fee": 250,
-                    "spending_cap": "$25,000/year",
-                    "promotional_offers": "90k points after $6k spend",
-                    "source_quality": "high"
-                }
-            ],
-            "travel": [
-                {
-                    "card_name": "Capital One Venture X",
-                    "issuer": "Capital One",
-                    "category_rate": "2x miles on everything",
-                    "annual_fee": 395,
-                    "spending_cap": None,
-                    "promotional_offers": "75k miles after $4k spend",
-                    "source_quality": "high"
-                },
-                {
-                    "card_name": "Chase Sapphire Reserve",
-                    "issuer": "Chase",
-                    "category_rate": "3x points",
-                    "annual_fee": 550,
-                    "spending_cap": None,
-                    "promotional_offers": "60k points after $4k spend",
-                    "source_quality": "high"
-                }
-            ]
-        }
-        
-        return cards_by_category.get(category, [
-            {
-                "card_name": "Citi Double Cash",
-                "issuer": "Citi",
-                "category_rate": "2% cash back",
-                "annual_fee": 0,
-                "spending_cap": None,
-                "promotional_offers": "$200 after $1.5k spend",
-                "source_quality": "medium"
-            }
-        ])
+        # Copies, so callers can annotate cards without touching the shared table
+        return [dict(card) for card in _FALLBACK_CARDS.get(category, _DEFAULT_FALLBACK_CARDS)]
     
     def _fallback_recommendation(self, transaction: Dict) -> Dict:
         """Fallback recommendation without API"""
         category = transaction.get("category", "other")
         amount = transaction.get("amount", 100)
         
-        recommendations = {
-            "dining": {
-                "best_overall": {
-                    "name": "Capital One Savor",
-                    "reward_amount": round(amount * 0.04, 2),
-                    "reward_rate": "4% cash back on dining",
-                    "annual_fee": 95,
-                    "signup_bonus": "$300 after $3k spend",
-                    "ai_reasoning": "Highest flat dining cash back rate available"
-                },
-                "runner_up": {
-                    "name": "Chase Sapphire Preferred",
-                    "reward_amount": round(amount * 0.03, 2),
-                    "reward_rate": "3x points on dining",
-                    "annual_fee": 95,
-                    "ai_reasoning": "Better for travel redemptions"
-                }
-            },
-            "grocery": {
-                "best_overall": {
-                    "name": "Amex Blue Cash Preferred",
-                    "reward_amount": round(amount * 0.06, 2),
-                    "reward_rate": "6% cash back on groceries",
-                    "annual_fee": 95,
-                    "signup_bonus": "$350 after $3k spend",
-                    "ai_reasoning": "Highest grocery cash back rate in market"
-                },
-                "runner_up": {
-                    "name": "Amex Gold Card",
-                    "reward_amount": round(amount * 0.04, 2),
-                    "reward_rate": "4x points on groceries",
-                    "annual_fee": 250,
-                    "ai_reasoning": "Better for premium travel redemptions"
-                }
-            }
-        }
-        
-        rec = recommendations.get(category, {
-            "best_overall": {
-                "name": "Citi Double Cash",
-                "reward_amount": round(amount * 0.02, 2),
-                "reward_rate": "2% cash back on everything",
-                "annual_fee": 0,
-                "signup_bonus": "$200 after $1.5k spend",
-                "ai_reasoning": "Best general purpose cash back card"
-            },
-            "runner_up": {
-                "name": "Chase Freedom Unlimited",
-                "reward_amount": round(amount * 0.015, 2),
-                "reward_rate": "1.5% cash back",
-                "annual_fee": 0,
-                "ai_reasoning": "No annual fee option"
-            }
-        })
+        # reward_amount is filled in below from _FALLBACK_REWARD_RATES
+        rec = copy.deepcopy(_FALLBACK_RECOMMENDATIONS.get(category, _DEFAULT_FALLBACK_RECOMMENDATION))
         
-        # Helper to compute reward dollars from a reward_rate string and amount
-        def compute_reward_amount(rate_str: str, amt: float) -> float:
-            try:
-                if not rate_str:
-                    return round(amt * 0.02, 2)
-                s = rate_str.lower()
-                import re
-                pct = re.search(r'(\d+(?:\.\d+)?)\s*%\b', s)
-                mult = re.search(r'(\d+(?:\.\d+)?)\s*x\b', s)
-                if pct:
-                    rate = float(pct.group(1)) / 100.0
-                    return round(amt * rate, 2)
-                if mult and ('point' in s or 'mile' in s):
-                    x = float(mult.group(1))
-                    point_value = 0.015  # 1.5 cents/point
-                    return round(amt * x * point_value, 2)
-                return round(amt * 0.02, 2)
-            except Exception:
-                return round(amt * 0.02, 2)
-
-        # Recalculate from reward_rate strings to ensure correctness
+        # Fill in reward dollars from each card's precomputed effective rate
         try:
             for key in ["best_overall", "runner_up", "alternative"]:
                 entry = rec.get(key)
                 if isinstance(entry, dict):
-                    entry["reward_amount"] = compute_reward_amount(entry.get("reward_rate", ""), amount)
+                    rate = _FALLBACK_REWARD_RATES.get(entry.get("name"), 0.02)
+                    entry["reward_amount"] = round(amount * rate, 2)
 
             # Reorder best/runner_up by net value (reward - fee/365)
             best = rec.get("best_overall", {})
@@ -554,5 +714,6 @@ CRITICAL: For reward calculations:
 
         rec["opportunity_cost"] = f"Missing ${round(rec['best_overall']['reward_amount'] - amount * 0.01, 2)} vs 1% card"
         rec["annual_projection"] = f"Could earn ${round(rec['best_overall']['reward_amount'] * 12, 2)}/year at this rate"
+        rec["is_fallback"] = True
         
         return rec
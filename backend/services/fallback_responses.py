@@ -1,13 +1,44 @@
 """
 Fallback responses for demo safety
 """
+import copy
 import logging
-from typing import Dict, Any
+import re
+import orjson
+from functools import lru_cache
+from operator import itemgetter
+from types import MappingProxyType
+from typing import Dict, Any, Mapping, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
-# Pre-configured fallback responses for demo scenarios
-FALLBACK_RESPONSES = {
+# Keywords that select each category's canned response (plain substring matches)
+FALLBACK_CATEGORY_KEYWORDS = {
+    "dining": ('coffee', 'starbucks', 'restaurant', 'dining', 'lunch', 'dinner'),
+    "grocery": ('grocery', 'whole foods', 'walmart', 'target', 'kroger'),
+    "travel": ('flight', 'hotel', 'travel', 'trip', 'vacation'),
+}
+
+# Compiled once: one named group per category, so a single scan finds the first keyword hit
+_CATEGORY_RE = re.compile("|".join(
+    f"(?P<{category}>" + "|".join(map(re.escape, keywords)) + ")"
+    for category, keywords in FALLBACK_CATEGORY_KEYWORDS.items()
+))
+_AMOUNT_RE = re.compile(r'\$?([\d,]+\.?\d*)')
+_PCT_RE = re.compile(r'(\d+(?:\.\d+)?)\s*%')
+_MULT_RE = re.compile(r'(\d+(?:\.\d+)?)\s*x\b')
+_RANKED_KEYS = ("best_overall", "runner_up", "alternative")
+
+def _freeze(value):
+    """Recursively make a template read-only (dicts -> MappingProxyType, lists -> tuples)"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+# Pre-configured fallback responses for demo scenarios, frozen so no call can write into them
+FALLBACK_RESPONSES = _freeze({
     "dining": {
         "parsed_transaction": {
             "merchant": "Restaurant",
@@ -146,126 +177,161 @@ FALLBACK_RESPONSES = {
             "annual_projection": "Annual travel rewards potential: $480+"
         }
     }
-}
+})
+
+# Used when no category keyword matches
+_GENERIC_FALLBACK = _freeze({
+    "parsed_transaction": {
+        "merchant": "Unknown",
+        "amount": 100.00,
+        "category": "shopping",
+        "confidence": 0.7,
+        "ai_reasoning": "General purchase detected"
+    },
+    "market_analysis": {
+        "cards_analyzed": 10,
+        "data_sources": ["demo mode"],
+        "confidence": 0.8
+    },
+    "recommendation": {
+        "best_overall": {
+            "name": "Citi Double Cash",
+            "reward_amount": 2.00,
+            "reward_rate": "2% cash back on everything",
+            "annual_fee": 0,
+            "signup_bonus": "$200 after $1.5k spend",
+            "ai_reasoning": "Best general purpose cash back"
+        },
+        "runner_up": {
+            "name": "Chase Freedom Unlimited",
+            "reward_amount": 1.50,
+            "reward_rate": "1.5% cash back",
+            "annual_fee": 0,
+            "ai_reasoning": "No annual fee alternative"
+        },
+        "alternative": {
+            "name": "Capital One Quicksilver",
+            "reward_amount": 1.50,
+            "reward_rate": "1.5% cash back",
+            "annual_fee": 0,
+            "ai_reasoning": "Simple cash back with no foreign transaction fees"
+        },
+        "opportunity_cost": "Optimized for general spending",
+        "annual_projection": "Could earn $240/year"
+    },
+    "financial_insight": {
+        "opportunity_cost": "Using optimal general card",
+        "annual_projection": "Projected annual rewards: $240"
+    }
+})
+
+@lru_cache(maxsize=256)
+def _reward_rate(rate_str: str) -> float:
+    """Reward dollars per purchase dollar described by a reward_rate string"""
+    s = (rate_str or "").lower()
+    pct = _PCT_RE.search(s)
+    if pct:
+        return float(pct.group(1)) / 100.0
+    mult = _MULT_RE.search(s)
+    if mult and ('point' in s or 'mile' in s):
+        # Points are earned per dollar (e.g., 3x points => 3 points per $1), valued at
+        # 1.5 cents per point/mile to align with compare_cards()
+        return float(mult.group(1)) * 0.015
+    # Default baseline 2%
+    return 0.02
+
+def _reward_amount(rate_str: str, amount: float) -> float:
+    """Reward dollars for a purchase at the rate described by a reward_rate string"""
+    return round(amount * _reward_rate(rate_str), 2)
+
+def _fresh_response(template: Mapping[str, Any]) -> Dict[str, Any]:
+    """Writable, JSON-serializable copy of a frozen template; leaf values are shared by reference"""
+    recommendation = template["recommendation"]
+    return {
+        "parsed_transaction": dict(template["parsed_transaction"]),
+        "market_analysis": dict(template["market_analysis"]),
+        "recommendation": {k: dict(v) if isinstance(v, Mapping) else v for k, v in recommendation.items()},
+        "financial_insight": dict(template["financial_insight"]),
+    }
 
 def get_fallback_recommendation(query: str) -> Dict[str, Any]:
     """Get appropriate fallback response based on query"""
-    query_lower = query.lower()
-    
+    logger.info("Using fallback recommendation")
+    # Private copy so callers can't write into the memoized response (or its encoded bytes)
+    return copy.deepcopy(_build_response(*_classify(query)))
+
+def get_fallback_recommendation_bytes(query: str) -> bytes:
+    """Same as get_fallback_recommendation, already encoded as a JSON body"""
+    logger.info("Using fallback recommendation")
+    key = _classify(query)
+    encoded = _PRECOMPUTED_RESPONSES.get(key)
+    return encoded if encoded is not None else _encoded_response(*key)
+
+def _classify(query: str) -> Tuple[Optional[str], float]:
+    """Detect the fallback category and the purchase amount for a query"""
     # Detect category from query
-    if any(word in query_lower for word in ['coffee', 'starbucks', 'restaurant', 'dining', 'lunch', 'dinner']):
-        response = FALLBACK_RESPONSES["dining"].copy()
-    elif any(word in query_lower for word in ['grocery', 'whole foods', 'walmart', 'target', 'kroger']):
-        response = FALLBACK_RESPONSES["grocery"].copy()
-    elif any(word in query_lower for word in ['flight', 'hotel', 'travel', 'trip', 'vacation']):
-        response = FALLBACK_RESPONSES["travel"].copy()
-    else:
-        # Generic fallback
-        response = {
-            "parsed_transaction": {
-                "merchant": "Unknown",
-                "amount": 100.00,
-                "category": "shopping",
-                "confidence": 0.7,
-                "ai_reasoning": "General purchase detected"
-            },
-            "market_analysis": {
-                "cards_analyzed": 10,
-                "data_sources": ["demo mode"],
-                "confidence": 0.8
-            },
-            "recommendation": {
-                "best_overall": {
-                    "name": "Citi Double Cash",
-                    "reward_amount": 2.00,
-                    "reward_rate": "2% cash back on everything",
-                    "annual_fee": 0,
-                    "signup_bonus": "$200 after $1.5k spend",
-                    "ai_reasoning": "Best general purpose cash back"
-                },
-                "runner_up": {
-                    "name": "Chase Freedom Unlimited",
-                    "reward_amount": 1.50,
-                    "reward_rate": "1.5% cash back",
-                    "annual_fee": 0,
-                    "ai_reasoning": "No annual fee alternative"
-                },
-                "alternative": {
-                    "name": "Capital One Quicksilver",
-                    "reward_amount": 1.50,
-                    "reward_rate": "1.5% cash back",
-                    "annual_fee": 0,
-                    "ai_reasoning": "Simple cash back with no foreign transaction fees"
-                },
-                "opportunity_cost": "Optimized for general spending",
-                "annual_projection": "Could earn $240/year"
-            },
-            "financial_insight": {
-                "opportunity_cost": "Using optimal general card",
-                "annual_projection": "Projected annual rewards: $240"
-            }
-        }
+    match = _CATEGORY_RE.search(query.lower())
+    category = match.lastgroup if match else None
     
-    # Helper to compute reward dollars from a reward_rate string and amount
-    def compute_reward_amount(rate_str: str, amount: float) -> float:
-        try:
-            if not rate_str:
-                return round(amount * 0.02, 2)
-            s = rate_str.lower()
-            import re
-            pct = re.search(r'(\d+(?:\.\d+)?)\s*%\b', s)
-            mult = re.search(r'(\d+(?:\.\d+)?)\s*x\b', s)
-            if pct:
-                rate = float(pct.group(1)) / 100.0
-                return round(amount * rate, 2)
-            if mult and ('point' in s or 'mile' in s):
-                x = float(mult.group(1))
-                # Use 1.5 cents per point/mile to align with compare_cards()
-                point_value = 0.015
-                # Points are earned per dollar (e.g., 3x points => 3 points per $1)
-                # Convert points to dollars via point value
-                return round(amount * x * point_value, 2)
-            # Default baseline 2%
-            return round(amount * 0.02, 2)
-        except Exception:
-            return round(amount * 0.02, 2)
-
-    # Extract amount from query if present; otherwise use default in parsed_transaction
-    import re
-    amount_match = re.search(r'\$?([\d,]+\.?\d*)', query)
+    # Extract amount from query if present; otherwise use default in parsed_transaction,
+    # so queries without one share the response precomputed at import
+    amount = FALLBACK_RESPONSES.get(category, _GENERIC_FALLBACK)["parsed_transaction"]["amount"]
+    amount_match = _AMOUNT_RE.search(query)
     if amount_match:
         try:
-            amount = float(amount_match.group(1).replace(',', ''))
-            response["parsed_transaction"]["amount"] = amount
+            amount = round(float(amount_match.group(1).replace(',', '')), 2)
         except ValueError:
             pass
+    return category, amount
+
+@lru_cache(maxsize=512)
+def _encoded_response(category: Optional[str], amount: float) -> bytes:
+    return orjson.dumps(_build_response(category, amount))
+
+@lru_cache(maxsize=512)
+def _build_response(category: Optional[str], amount: float) -> Dict[str, Any]:
+    """Fallback response for a detected category and parsed amount, memoized since it's deterministic"""
+    response = _fresh_response(FALLBACK_RESPONSES.get(category, _GENERIC_FALLBACK))
+
+    response["parsed_transaction"]["amount"] = amount
 
     # Recalculate rewards uniformly for all recommendation entries based on parsed amount
     try:
         amount = float(response["parsed_transaction"].get("amount", 0) or 0)
-        if amount > 0 and "recommendation" in response:
-            for key in ["best_overall", "runner_up", "alternative"]:
-                entry = response["recommendation"].get(key)
+        recommendation = response.get("recommendation")
+        if amount > 0 and recommendation:
+            # One pass: recompute each entry's reward and its net value after the daily fee share
+            entries = []
+            for key in _RANKED_KEYS:
+                entry = recommendation.get(key)
                 if isinstance(entry, dict):
-                    rate_str = entry.get("reward_rate", "")
-                    entry["reward_amount"] = compute_reward_amount(rate_str, amount)
+                    reward = _reward_amount(entry.get("reward_rate", ""), amount)
+                    entry["reward_amount"] = reward
+                    entries.append((reward - float(entry.get("annual_fee", 0) or 0) / 365.0, entry))
             # Ensure best_overall reflects highest net value among available entries
-            entries = []
-            for key in ["best_overall", "runner_up", "alternative"]:
-                e = response["recommendation"].get(key)
-                if isinstance(e, dict):
-                    annual_fee = float(e.get("annual_fee", 0) or 0)
-                    net_value = float(e.get("reward_amount", 0) or 0) - (annual_fee / 365.0)
-                    entries.append((key, e, net_value))
             if len(entries) >= 2:
-                entries.sort(key=lambda t: t[2], reverse=True)
+                entries.sort(key=itemgetter(0), reverse=True)
                 # Reassign best and runner up; keep alternative as the next if present
-                response["recommendation"]["best_overall"] = entries[0][1]
-                response["recommendation"]["runner_up"] = entries[1][1]
+                recommendation["best_overall"] = entries[0][1]
+                recommendation["runner_up"] = entries[1][1]
                 if len(entries) > 2:
-                    response["recommendation"]["alternative"] = entries[2][1]
+                    recommendation["alternative"] = entries[2][1]
     except Exception as e:
-        logger.warning(f"Fallback reward recalculation skipped: {e}")
+        logger.warning("Fallback reward recalculation skipped: %s", e)
 
-    logger.info("Using fallback recommendation")
     return response
+
+# Round-dollar amounts demo queries cluster on; served from cache exactly, never snapped
+PRECOMPUTED_AMOUNTS = (10.0, 25.0, 50.0, 100.0, 200.0, 500.0, 1000.0, 2000.0, 5000.0)
+
+def _precompute_responses() -> Dict[Tuple[Optional[str], float], bytes]:
+    """Encoded default-amount and round-dollar responses for every category (and generic)"""
+    return {
+        (category, amount): orjson.dumps(_build_response(category, amount))
+        for category, template in (*FALLBACK_RESPONSES.items(), (None, _GENERIC_FALLBACK))
+        for amount in {template["parsed_transaction"]["amount"], *PRECOMPUTED_AMOUNTS}
+    }
+
+# Kept outside the LRUs so other amounts can never evict them (building them also parses
+# every canned reward_rate into _reward_rate's cache)
+_PRECOMPUTED_RESPONSES = _precompute_responses()